@@ -1,4 +1,4 @@
-from flask import Flask, json, jsonify, redirect, render_template, request, session, abort, url_for
+from flask import Flask, json, jsonify, redirect, render_template, request, session, abort, url_for, has_request_context, g
 import sqlite3 as sq
 import socket
 import bcrypt
@@ -7,6 +7,15 @@ from flask_socketio import SocketIO, join_room
 import uuid
 from functools import wraps
 import os
+import threading
+import contextvars
+import csv
+import io
+import time
+import re
+import math
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 
 timers_attivi = {}
 
@@ -23,6 +32,105 @@ socketio = SocketIO(
     
 )
 
+# esecutore DB: se attivo, ogni accesso a sqlite gira su thread dedicati
+# cosi' i greenlet (e i websocket) non restano bloccati su lock o disco
+DB_EXECUTOR = os.environ.get("DB_EXECUTOR", "0") == "1"
+DB_EXECUTOR_THREADS = int(os.environ.get("DB_EXECUTOR_THREADS", 1))
+# richieste HTTP in attesa di un thread DB libero, oltre le quali si risponde 503
+# (0 = nessun limite). Le operazioni gia' in esecuzione e i task in background non contano
+DB_QUEUE_MAX = int(os.environ.get("DB_QUEUE_MAX", 32))
+
+# fuso orario di cassa e dashboard (data_ordine nel DB e' in UTC)
+FUSO_ORARIO = ZoneInfo(os.environ.get("TIMEZONE", "Europe/Rome"))
+
+
+class DBSovraccarico(Exception):
+    """Troppe richieste in attesa del DB: la richiesta va rifiutata con 503."""
+
+
+class DBExecutor:
+    def __init__(self, threads, max_coda):
+        self.threads = threads
+        self.max_coda = max_coda
+        self.in_attesa = 0
+        if socketio.async_mode == "gevent":
+            # lock nativo: lo prendono anche i thread del pool, non solo i greenlet
+            from gevent.monkey import get_original
+            self._lock = get_original("_thread", "allocate_lock")()
+        else:
+            self._lock = threading.Lock()
+        self._pool = None
+        # vale True solo dentro i thread dell'esecutore (evita deadlock sulle chiamate annidate)
+        self._dentro = contextvars.ContextVar("db_executor_dentro", default=False)
+
+    def _get_pool(self):
+        if self._pool is None:
+            if socketio.async_mode == "gevent":
+                # thread nativi: il greenlet che aspetta cede il controllo all'hub
+                from gevent.threadpool import ThreadPool
+                self._pool = ThreadPool(self.threads)
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="db")
+        return self._pool
+
+    # toglie il job dal conteggio dell'attesa una sola volta (all'avvio o all'uscita)
+    def _fine_attesa(self, job):
+        with self._lock:
+            if job["in_attesa"]:
+                job["in_attesa"] = False
+                self.in_attesa -= 1
+
+    def _esegui(self, job, fn, args, kwargs):
+        self._fine_attesa(job)
+        self._dentro.set(True)
+        return fn(*args, **kwargs)
+
+    def run(self, fn, *args, scarta=True, **kwargs):
+        # gia' dentro l'esecutore → esegui direttamente
+        if self._dentro.get():
+            return fn(*args, **kwargs)
+
+        # solo le richieste HTTP contano per il limite: i task in background
+        # hanno una corsia propria e non possono far rifiutare le richieste
+        job = {"in_attesa": scarta}
+        if scarta:
+            with self._lock:
+                if self.max_coda and self.in_attesa >= self.max_coda:
+                    raise DBSovraccarico()
+                self.in_attesa += 1
+
+        try:
+            pool = self._get_pool()
+            if socketio.async_mode == "gevent":
+                return pool.spawn(self._esegui, job, fn, args, kwargs).get()
+            return pool.submit(self._esegui, job, fn, args, kwargs).result()
+        finally:
+            self._fine_attesa(job)
+
+
+db_executor = DBExecutor(DB_EXECUTOR_THREADS, DB_QUEUE_MAX)
+
+def esegui_db(fn, *args, **kwargs):
+    if not DB_EXECUTOR:
+        return fn(*args, **kwargs)
+    # le richieste HTTP vengono scartate se la coda e' piena, ma solo al primo accesso
+    # al DB: una richiesta ammessa non viene rifiutata a meta' delle sue scritture.
+    # i task in background (timer, statistiche) aspettano sempre il loro turno
+    scarta = False
+    if has_request_context():
+        scarta = not g.get("db_ammessa", False)
+        g.db_ammessa = True
+    return db_executor.run(fn, *args, scarta=scarta, **kwargs)
+
+@app.errorhandler(DBSovraccarico)
+def db_sovraccarico(e):
+    app.logger.warning(f"[DB] Coda piena ({db_executor.in_attesa} in attesa), richiesta rifiutata")
+    response = jsonify({"errore": "Server occupato, riprova tra poco"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 def login_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -80,6 +188,9 @@ def require_permission(pagina):
 
 # chiude in automatico la connessione con il db in caso di errore
 def query_db(query, args=(), one=False, commit=False):
+    return esegui_db(_query_db, query, args, one, commit)
+
+def _query_db(query, args, one, commit):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute(query, args)
@@ -111,6 +222,69 @@ def get_db():
     conn.row_factory = sq.Row
     return conn
 
+# crea le tabelle mancanti e aggiorna i database creati con uno schema precedente
+def assicura_schema():
+    schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.sql")
+    with open(schema_path) as f:
+        schema = f.read()
+
+    with get_db() as conn:
+        colonne = [r["name"] for r in conn.execute("PRAGMA table_info(ordini_prodotti)")]
+        if colonne and "prezzo" not in colonne:
+            # le righe vecchie prendono il prezzo attuale: e' l'unico dato disponibile
+            conn.execute("ALTER TABLE ordini_prodotti ADD COLUMN prezzo REAL NOT NULL DEFAULT 0")
+            # righe di prodotti cancellati: prezzo sconosciuto, restano a 0
+            conn.execute("""
+                UPDATE ordini_prodotti
+                SET prezzo = COALESCE(
+                    (SELECT prezzo FROM prodotti WHERE prodotti.id = ordini_prodotti.prodotto_id), 0
+                )
+            """)
+        conn.executescript(schema)
+
+        # indice full-text indietro rispetto agli ordini (appena creato qui o da create_db.py
+        # su un database gia' usato): va ricostruito con gli ordini presenti
+        indicizzati = conn.execute("SELECT COUNT(*) FROM ordini_fts_docsize").fetchone()[0]
+        ordini = conn.execute("SELECT COUNT(*) FROM ordini").fetchone()[0]
+        if indicizzati != ordini:
+            conn.execute("INSERT INTO ordini_fts (ordini_fts) VALUES ('rebuild')")
+
+# fase di avvio: schema subito, riscaldamento in background
+stato_avvio = {"avviato": False, "pronto": False, "secondi": None, "errore": None}
+
+def riscalda_app():
+    inizio = time.perf_counter()
+    try:
+        # compila e mette in cache tutti i template jinja
+        for nome in app.jinja_env.list_templates():
+            app.jinja_env.get_template(nome)
+
+        # ricostruisce le statistiche prima del primo ordine
+        ricalcola_statistiche()
+    except Exception as e:
+        # resta non pronto: /ready/ riporta l'errore e il deploy non riceve traffico
+        stato_avvio["errore"] = f"{type(e).__name__}: {e}"
+        app.logger.exception("[AVVIO] Errore durante il riscaldamento")
+        return
+
+    stato_avvio["secondi"] = round(time.perf_counter() - inizio, 3)
+    stato_avvio["errore"] = None
+    stato_avvio["pronto"] = True
+    app.logger.info(f"[AVVIO] Pronto in {stato_avvio['secondi']}s")
+
+def create_app():
+    if not stato_avvio["avviato"]:
+        stato_avvio["avviato"] = True
+        assicura_schema()
+        socketio.start_background_task(riscalda_app)
+    return app
+
+@app.route('/ready/')
+def ready():
+    if not stato_avvio["pronto"]:
+        return jsonify({"pronto": False, "errore": stato_avvio["errore"]}), 503
+    return jsonify({"pronto": True, "riscaldamento_secondi": stato_avvio["secondi"]})
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -119,20 +293,7 @@ def index():
 @login_required
 @require_permission("CASSA")
 def cassa():
-    conn = get_db()
-    conn.row_factory = sq.Row
-    cur = conn.cursor()
-
-    # usa GROUP BY per ottenere categorie uniche mantenendo l'ordine originale
-    categorie_rows = query_db('SELECT categoria_menu FROM prodotti GROUP BY categoria_menu ORDER BY MIN(id)')
-    categorie = [row['categoria_menu'] for row in categorie_rows]
-
-    # prodotti per ogni categoria
-    prodotti_per_categoria = {}
-    for categoria in categorie:
-        prodotti_per_categoria[categoria] = query_db(
-            'SELECT * FROM prodotti WHERE categoria_menu = ?', (categoria,)
-        )
+    categorie, prodotti_per_categoria = carica_catalogo()
 
     return render_template(
         'cassa.html',
@@ -140,6 +301,14 @@ def cassa():
         prodotti_per_categoria=prodotti_per_categoria
     )
 
+def carica_catalogo():
+    # una sola query: le categorie restano nell'ordine del primo prodotto (MIN(id))
+    prodotti_per_categoria = {}
+    for prodotto in query_db('SELECT * FROM prodotti ORDER BY id'):
+        prodotti_per_categoria.setdefault(prodotto['categoria_menu'], []).append(prodotto)
+
+    return list(prodotti_per_categoria), prodotti_per_categoria
+
 @app.route('/aggiungi_ordine/', methods=['POST'])
 def aggiungi_ordine():
     # Recupera i dati dal form
@@ -161,6 +330,22 @@ def aggiungi_ordine():
         prodotti = []
 
     # Inserisce il nuovo ordine
+    try:
+        order_id, categorie_dashboard = esegui_db(
+            salva_ordine, asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, prodotti
+        )
+    except ValueError:
+        abort(400)
+
+    # Avvisa le dashboard in tempo reale
+    for cat in categorie_dashboard:
+        safe_emit('aggiorna_dashboard', {'categoria': cat}, room=cat)
+    socketio.start_background_task(ricalcola_statistiche)
+
+    return redirect(url_for('cassa') + f'?last_order_id={order_id}', code=303)
+
+# scrive ordine, righe e magazzino in un'unica transazione
+def salva_ordine(asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, prodotti):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
@@ -171,10 +356,14 @@ def aggiungi_ordine():
 
         # Inserisci i prodotti e aggiorna il magazzino
         for p in prodotti:
+            # il prezzo di vendita resta salvato sulla riga anche se il menu cambia
             cur.execute("""
-                INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato)
-                VALUES (?, ?, ?, ?)
-            """, (order_id, p["id"], p["quantita"], "In Attesa"))
+                INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo)
+                SELECT ?, id, ?, ?, prezzo FROM prodotti WHERE id = ?
+            """, (order_id, p["quantita"], "In Attesa", p["id"]))
+            if cur.rowcount == 0:
+                # prodotto inesistente: l'eccezione annulla tutta la transazione
+                raise ValueError(f"Prodotto non trovato: {p['id']}")
             cur.execute("""
                 UPDATE prodotti
                 SET quantita = quantita - ?, venduti = venduti + ?
@@ -191,12 +380,7 @@ def aggiungi_ordine():
         categorie_dashboard = [row[0] for row in cur.fetchall()] # Trasforma il risultato SQL in una lista Python
         conn.commit()  # Chiude automaticamente alla fine del blocco
 
-    # Avvisa le dashboard in tempo reale
-    for cat in categorie_dashboard:
-        safe_emit('aggiorna_dashboard', {'categoria': cat}, room=cat)
-    socketio.start_background_task(ricalcola_statistiche)
-
-    return redirect(url_for('cassa') + f'?last_order_id={order_id}', code=303)
+    return order_id, categorie_dashboard
 
 @app.route('/dashboard/<category>/')
 @login_required
@@ -249,25 +433,7 @@ def cambia_stato():
         nuovo_stato = stati[stati.index(stato_attuale) + 1]
 
     # Aggiorna lo stato nel DB
-    query_db("""
-        UPDATE ordini_prodotti
-        SET stato = ?
-        WHERE ordine_id = ?
-        AND prodotto_id IN (
-            SELECT id FROM prodotti WHERE categoria_dashboard = ?
-        );
-    """, (nuovo_stato, ordine_id, categoria), commit=True)
-
-    residui = query_db(
-        "SELECT COUNT(*) AS c FROM ordini_prodotti WHERE ordine_id = ? AND stato != 'Completato'",
-        (ordine_id,),
-        one=True
-    )["c"]
-    query_db(
-        "UPDATE ordini SET completato = ? WHERE id = ?",
-        (1 if residui == 0 else 0, ordine_id),
-        commit=True
-    )
+    esegui_db(aggiorna_stato_ordine, ordine_id, categoria, nuovo_stato)
 
     # Avvisa subito la dashboard
     safe_emit('aggiorna_dashboard', {'categoria': categoria}, room=categoria)
@@ -301,6 +467,30 @@ def cambia_stato():
     })
 
 
+# aggiorna lo stato di una postazione e il flag completato dell'ordine in un'unica transazione
+def aggiorna_stato_ordine(ordine_id, categoria, nuovo_stato):
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE ordini_prodotti
+            SET stato = ?
+            WHERE ordine_id = ?
+            AND prodotto_id IN (
+                SELECT id FROM prodotti WHERE categoria_dashboard = ?
+            );
+        """, (nuovo_stato, ordine_id, categoria))
+
+        cur.execute(
+            "SELECT COUNT(*) AS c FROM ordini_prodotti WHERE ordine_id = ? AND stato != 'Completato'",
+            (ordine_id,)
+        )
+        residui = cur.fetchone()["c"]
+        cur.execute(
+            "UPDATE ordini SET completato = ? WHERE id = ?",
+            (1 if residui == 0 else 0, ordine_id)
+        )
+        conn.commit()
+
 @app.route('/dashboard/<category>/partial')
 def dashboard_partial(category):
     ordini_non_completati, ordini_completati = get_ordini_per_categoria(category)
@@ -394,25 +584,7 @@ def cambia_stato_automatico(ordine_id, categoria, timer_id):
         return
 
     # Aggiorna stato a completato
-    query_db("""
-        UPDATE ordini_prodotti
-        SET stato = 'Completato'
-        WHERE ordine_id = ?
-        AND prodotto_id IN (
-            SELECT id FROM prodotti WHERE categoria_dashboard = ?
-        );
-    """, (ordine_id, categoria), commit=True)
-
-    residui = query_db(
-        "SELECT COUNT(*) AS c FROM ordini_prodotti WHERE ordine_id = ? AND stato != 'Completato'",
-        (ordine_id,),
-        one=True
-    )["c"]
-    query_db(
-        "UPDATE ordini SET completato = ? WHERE id = ?",
-        (1 if residui == 0 else 0, ordine_id),
-        commit=True
-    )
+    esegui_db(aggiorna_stato_ordine, ordine_id, categoria, 'Completato')
 
     # Rimuovi il timer dalla lista
     timers_attivi.pop(timer_key, None)
@@ -429,9 +601,8 @@ def api_statistiche():
 
     totale_incasso_row = query_db(
         """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
+        SELECT SUM(op.prezzo * op.quantita) AS totale
         FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
         """,
         one=True
     )
@@ -439,9 +610,8 @@ def api_statistiche():
 
     totale_contanti_row = query_db(
         """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
+        SELECT SUM(op.prezzo * op.quantita) AS totale
         FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
         JOIN ordini o ON o.id = op.ordine_id
         WHERE o.metodo_pagamento = 'Contanti'
         """,
@@ -451,9 +621,8 @@ def api_statistiche():
 
     totale_carta_row = query_db(
         """
-        SELECT SUM(p.prezzo * op.quantita) AS totale
+        SELECT SUM(op.prezzo * op.quantita) AS totale
         FROM ordini_prodotti op
-        JOIN prodotti p ON p.id = op.prodotto_id
         JOIN ordini o ON o.id = op.ordine_id
         WHERE o.metodo_pagamento = 'Carta'
         """,
@@ -519,7 +688,7 @@ def api_ordine(ordine_id):
         abort(404)
     items_rows = query_db(
         """
-        SELECT p.nome AS nome, op.quantita AS quantita, p.prezzo AS prezzo
+        SELECT p.nome AS nome, op.quantita AS quantita, op.prezzo AS prezzo
         FROM ordini_prodotti op
         JOIN prodotti p ON p.id = op.prodotto_id
         WHERE op.ordine_id = ?
@@ -540,6 +709,371 @@ def api_ordine(ordine_id):
         "items": items
     })
 
+STATI_ORDINE = ("In Attesa", "In Preparazione", "Pronto", "Completato")
+
+# "ros mar" → '"ros"* "mar"*': ogni parola in AND, con ricerca per prefisso
+def query_fts(testo):
+    parole = re.findall(r"\w+", testo or "")
+    return " ".join(f'"{p}"*' for p in parole)
+
+# converte un orario inserito dallo staff (ora locale se senza fuso) nel formato UTC di data_ordine
+def _data_ordine(valore, fine_giornata=False):
+    data = datetime.fromisoformat(valore)
+    if fine_giornata and len(valore) == 10:
+        data = data.replace(hour=23, minute=59, second=59)
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=FUSO_ORARIO)
+    return data.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def cerca_ordini(testo=None, tavolo=None, stato=None, da=None, a=None, limite=20):
+    filtri = []
+    valori = []
+
+    fts = query_fts(testo)
+    if fts:
+        # parte dall'indice full-text: gli id crescono con data_ordine,
+        # quindi l'ordine per rowid e' gia' quello cronologico
+        sorgente = "ordini_fts f JOIN ordini o ON o.id = f.rowid"
+        ordinamento = "f.rowid DESC"
+        filtri.append("ordini_fts MATCH ?")
+        valori.append(fts)
+    else:
+        sorgente = "ordini o"
+        ordinamento = "o.data_ordine DESC, o.id DESC"
+    if tavolo is not None:
+        filtri.append("o.numero_tavolo = ?")
+        valori.append(tavolo)
+    if stato:
+        filtri.append("EXISTS (SELECT 1 FROM ordini_prodotti WHERE ordine_id = o.id AND stato = ?)")
+        valori.append(stato)
+    if da:
+        filtri.append("o.data_ordine >= ?")
+        valori.append(da)
+    if a:
+        filtri.append("o.data_ordine <= ?")
+        valori.append(a)
+
+    where = ("WHERE " + " AND ".join(filtri)) if filtri else ""
+    valori.append(limite)
+
+    # testata, righe e stato per postazione in un'unica query
+    rows = query_db(f"""
+        WITH trovati AS (
+            SELECT o.id
+            FROM {sorgente}
+            {where}
+            ORDER BY {ordinamento}
+            LIMIT ?
+        )
+        SELECT
+            o.id,
+            o.nome_cliente,
+            o.numero_tavolo,
+            o.numero_persone,
+            o.metodo_pagamento,
+            o.data_ordine,
+            o.completato,
+            json_group_array(json_object(
+                'nome', p.nome,
+                'quantita', op.quantita,
+                'prezzo', op.prezzo,
+                'categoria', p.categoria_dashboard,
+                'stato', op.stato
+            )) FILTER (WHERE op.ordine_id IS NOT NULL) AS righe
+        FROM trovati t
+        JOIN ordini o ON o.id = t.id
+        LEFT JOIN ordini_prodotti op ON op.ordine_id = o.id
+        LEFT JOIN prodotti p ON p.id = op.prodotto_id
+        GROUP BY o.id
+        ORDER BY o.data_ordine DESC, o.id DESC
+    """, valori)
+
+    ordini = []
+    for r in rows:
+        items = json.loads(r["righe"])
+        stati = {}
+        for item in items:
+            # le righe di prodotti cancellati non hanno postazione
+            if item["categoria"] is not None:
+                stati[item["categoria"]] = item["stato"]
+        ordini.append({
+            "id": r["id"],
+            "nome_cliente": r["nome_cliente"],
+            "numero_tavolo": r["numero_tavolo"],
+            "numero_persone": r["numero_persone"],
+            "metodo_pagamento": r["metodo_pagamento"],
+            "data_ordine": r["data_ordine"],
+            "completato": bool(r["completato"]),
+            "stati": stati,
+            "items": items
+        })
+    return ordini
+
+# es: /api/ordini/cerca/?q=rossi&tavolo=12&stato=In Preparazione&da=2025-06-01
+@app.route('/api/ordini/cerca/')
+@login_required
+def api_ordini_cerca():
+    stato = request.args.get("stato") or None
+    if stato and stato not in STATI_ORDINE:
+        return jsonify({"errore": "Stato non valido"}), 400
+
+    try:
+        tavolo = int(request.args["tavolo"]) if request.args.get("tavolo") else None
+        limite = min(max(int(request.args.get("limite", 20)), 1), 100)
+        da = _data_ordine(request.args["da"]) if request.args.get("da") else None
+        a = _data_ordine(request.args["a"], fine_giornata=True) if request.args.get("a") else None
+    except (ValueError, OverflowError):
+        return jsonify({"errore": "Filtri non validi"}), 400
+
+    testo = request.args.get("q", "").strip()
+    if testo and not query_fts(testo):
+        return jsonify({"errore": "Testo di ricerca non valido"}), 400
+
+    ordini = cerca_ordini(testo, tavolo, stato, da, a, limite)
+    return jsonify({"ordini": ordini})
+
+CATEGORIE_DASHBOARD = ("Bar", "Cucina", "Gnoccheria", "Griglia", "Coperto")
+
+# accetta solo valori vero/falso espliciti; vuoto → default (se previsto), altrimenti ValueError
+def _vero(valore, default=None):
+    if valore is None or valore == "":
+        if default is None:
+            raise ValueError("Valore vero/falso mancante")
+        return default
+    testo = str(valore).strip().lower()
+    if testo in ("1", "true", "si", "sì", "on"):
+        return 1
+    if testo in ("0", "false", "no", "off"):
+        return 0
+    raise ValueError(f"Valore vero/falso non valido: {valore}")
+
+# numero intero senza troncare: 5, 5.0 e "5" vanno bene, 1.7 e "1.7" no
+def _intero(valore):
+    if isinstance(valore, bool):
+        raise ValueError("Numero intero non valido")
+    if isinstance(valore, float):
+        if not valore.is_integer():
+            raise ValueError("Numero intero non valido")
+        return int(valore)
+    if isinstance(valore, int):
+        return valore
+    return int(str(valore).strip())
+
+# legge il menu da CSV (file "file" o body text/csv) oppure da JSON {"prodotti": [...]}
+def leggi_menu(req):
+    if "file" in req.files or req.mimetype == "text/csv":
+        if "file" in req.files:
+            testo = req.files["file"].read().decode("utf-8-sig")
+        else:
+            testo = req.get_data(as_text=True)
+        righe = list(csv.DictReader(io.StringIO(testo)))
+        opzioni = req.form if req.form else req.args
+    else:
+        dati = req.get_json(silent=True)
+        if isinstance(dati, list):
+            # solo la lista dei prodotti: le opzioni arrivano dalla query string
+            righe = dati
+            opzioni = req.args
+        elif isinstance(dati, dict):
+            righe = dati.get("prodotti") or []
+            opzioni = dati
+        else:
+            raise ValueError("Menu non valido: atteso un oggetto o una lista JSON")
+
+    if not isinstance(righe, list):
+        raise ValueError("Menu non valido: prodotti deve essere una lista")
+
+    nome = opzioni.get("nome") or "Menu importato"
+    attiva = _vero(opzioni.get("attiva"), default=0)
+
+    prodotti = []
+    nomi = set()
+    for n, r in enumerate(righe, start=1):
+        try:
+            prodotto = {
+                "nome": str(r["nome"]).strip(),
+                "prezzo": float(r["prezzo"]),
+                "categoria_menu": str(r["categoria_menu"]).strip(),
+                "categoria_dashboard": str(r["categoria_dashboard"]).strip(),
+                "disponibile": _vero(r.get("disponibile"), default=1),
+                "quantita": _intero(r["quantita"]),
+            }
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError(f"Riga {n}: dati mancanti o non validi")
+
+        if not prodotto["nome"] or not prodotto["categoria_menu"]:
+            raise ValueError(f"Riga {n}: nome e categoria_menu sono obbligatori")
+        if prodotto["categoria_dashboard"] not in CATEGORIE_DASHBOARD:
+            raise ValueError(f"Riga {n}: categoria_dashboard non valida")
+        if not math.isfinite(prodotto["prezzo"]):
+            raise ValueError(f"Riga {n}: prezzo non valido")
+        if prodotto["prezzo"] < 0 or prodotto["quantita"] < 0:
+            raise ValueError(f"Riga {n}: prezzo e quantita non possono essere negativi")
+        if prodotto["nome"] in nomi:
+            raise ValueError(f"Riga {n}: prodotto duplicato ({prodotto['nome']})")
+        nomi.add(prodotto["nome"])
+        prodotti.append(prodotto)
+
+    if not prodotti:
+        raise ValueError("Il menu non contiene prodotti")
+
+    return nome, prodotti, attiva
+
+# sostituisce il catalogo in uso con una versione salvata.
+# i prodotti sono abbinati per nome: quelli assenti dalla versione vengono solo
+# disattivati, perche' gli ordini gia' fatti continuano a riferirli
+def _attiva_catalogo(cur, catalogo_id):
+    cur.execute("""
+        UPDATE prodotti SET disponibile = 0
+        WHERE nome NOT IN (SELECT nome FROM cataloghi_prodotti WHERE catalogo_id = ?)
+    """, (catalogo_id,))
+    cur.execute("""
+        UPDATE prodotti
+        SET prezzo = cp.prezzo,
+            categoria_menu = cp.categoria_menu,
+            categoria_dashboard = cp.categoria_dashboard,
+            disponibile = cp.disponibile,
+            quantita = cp.quantita
+        FROM cataloghi_prodotti AS cp
+        WHERE cp.catalogo_id = ? AND cp.nome = prodotti.nome
+    """, (catalogo_id,))
+    cur.execute("""
+        INSERT INTO prodotti (nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)
+        SELECT nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, 0
+        FROM cataloghi_prodotti
+        WHERE catalogo_id = ? AND nome NOT IN (SELECT nome FROM prodotti)
+        ORDER BY posizione
+    """, (catalogo_id,))
+    cur.execute("UPDATE cataloghi SET attivo = (id = ?)", (catalogo_id,))
+
+# salva una nuova versione del menu (ed eventualmente la attiva) in un'unica transazione
+def importa_catalogo(nome, prodotti, attiva):
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO cataloghi (nome) VALUES (?)", (nome,))
+        catalogo_id = cur.lastrowid
+        cur.executemany("""
+            INSERT INTO cataloghi_prodotti
+            (catalogo_id, posizione, nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (catalogo_id, i, p["nome"], p["prezzo"], p["categoria_menu"],
+             p["categoria_dashboard"], p["disponibile"], p["quantita"])
+            for i, p in enumerate(prodotti)
+        ])
+        if attiva:
+            _attiva_catalogo(cur, catalogo_id)
+        conn.commit()
+    return catalogo_id
+
+def attiva_catalogo(catalogo_id):
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM cataloghi WHERE id = ?", (catalogo_id,))
+        if not cur.fetchone():
+            return False
+        _attiva_catalogo(cur, catalogo_id)
+        conn.commit()
+    return True
+
+def aggiorna_prodotti(ids, categoria_menu, disponibile, quantita, delta_quantita):
+    modifiche = []
+    valori = []
+    if disponibile is not None:
+        modifiche.append("disponibile = ?")
+        valori.append(disponibile)
+    if quantita is not None:
+        modifiche.append("quantita = ?")
+        valori.append(quantita)
+    if delta_quantita is not None:
+        modifiche.append("quantita = MAX(quantita + ?, 0)")
+        valori.append(delta_quantita)
+
+    if ids:
+        filtro = "id IN (%s)" % ", ".join("?" * len(ids))
+        valori.extend(ids)
+    else:
+        filtro = "categoria_menu = ?"
+        valori.append(categoria_menu)
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"UPDATE prodotti SET {', '.join(modifiche)} WHERE {filtro}", valori)
+        aggiornati = cur.rowcount
+        conn.commit()
+    return aggiornati
+
+@app.route('/api/menu/importa/', methods=['POST'])
+@login_required
+@require_permission("AMMINISTRAZIONE")
+def api_menu_importa():
+    try:
+        nome, prodotti, attiva = leggi_menu(request)
+    except ValueError as e:
+        return jsonify({"errore": str(e)}), 400
+
+    catalogo_id = esegui_db(importa_catalogo, nome, prodotti, attiva)
+    return jsonify({
+        "catalogo_id": catalogo_id,
+        "prodotti": len(prodotti),
+        "attivo": bool(attiva)
+    }), 201
+
+@app.route('/api/menu/cataloghi/')
+@login_required
+@require_permission("AMMINISTRAZIONE")
+def api_menu_cataloghi():
+    rows = query_db("""
+        SELECT c.id, c.nome, c.data_creazione, c.attivo, COUNT(cp.nome) AS prodotti
+        FROM cataloghi c
+        LEFT JOIN cataloghi_prodotti cp ON cp.catalogo_id = c.id
+        GROUP BY c.id
+        ORDER BY c.id DESC
+    """)
+    return jsonify([dict(r) for r in rows])
+
+@app.route('/api/menu/cataloghi/<int:catalogo_id>/attiva/', methods=['POST'])
+@login_required
+@require_permission("AMMINISTRAZIONE")
+def api_menu_attiva(catalogo_id):
+    if not esegui_db(attiva_catalogo, catalogo_id):
+        abort(404)
+    return jsonify({"catalogo_id": catalogo_id, "attivo": True})
+
+# modifica in blocco disponibilita' e magazzino, per id o per categoria del menu
+@app.route('/api/menu/prodotti/', methods=['POST'])
+@login_required
+@require_permission("AMMINISTRAZIONE")
+def api_menu_prodotti():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"errore": "Dati non validi"}), 400
+    if not isinstance(data.get("ids", []), list):
+        return jsonify({"errore": "ids deve essere una lista"}), 400
+    categoria_menu = data.get("categoria_menu")
+    if categoria_menu is not None and not isinstance(categoria_menu, str):
+        return jsonify({"errore": "categoria_menu deve essere un testo"}), 400
+
+    try:
+        ids = [_intero(i) for i in data.get("ids") or []]
+        disponibile = None if data.get("disponibile") is None else _vero(data["disponibile"])
+        quantita = None if data.get("quantita") is None else _intero(data["quantita"])
+        delta_quantita = None if data.get("delta_quantita") is None else _intero(data["delta_quantita"])
+    except (TypeError, ValueError):
+        return jsonify({"errore": "Dati non validi"}), 400
+
+    if not ids and not categoria_menu:
+        return jsonify({"errore": "Specificare ids o categoria_menu"}), 400
+    if disponibile is None and quantita is None and delta_quantita is None:
+        return jsonify({"errore": "Nessuna modifica richiesta"}), 400
+    if quantita is not None and delta_quantita is not None:
+        return jsonify({"errore": "Usare quantita oppure delta_quantita, non entrambi"}), 400
+    if quantita is not None and quantita < 0:
+        return jsonify({"errore": "La quantita non puo' essere negativa"}), 400
+
+    aggiornati = esegui_db(aggiorna_prodotti, ids, categoria_menu, disponibile, quantita, delta_quantita)
+    return jsonify({"aggiornati": aggiornati})
+
 @app.route('/amministrazione/')
 @login_required
 @require_permission("AMMINISTRAZIONE")
@@ -548,115 +1082,84 @@ def amministrazione():
         "amministrazione.html"
     )
 
-def ricalcola_statistiche():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # carica tutti gli ordini
-    ordini = query_db("""
-        SELECT id, metodo_pagamento, data_ordine, completato
-        FROM ordini
-    """)
-
-    # totale ordini e completati
-    ordini_totali = len(ordini)
-    ordini_completati = sum(1 for o in ordini if o["completato"] == 1)
+# al massimo un ricalcolo in corso e uno in attesa: le richieste che arrivano
+# durante un ricalcolo vengono raccolte in un unico giro successivo
+ricalcolo = {"in_corso": False, "da_rifare": False}
+ricalcolo_lock = threading.Lock()
 
-    # reset statistiche totali
-    query_db("DELETE FROM statistiche_totali", commit=True)
-
-    # reset statistiche categorie
-    query_db("DELETE FROM statistiche_categorie", commit=True)
+def ricalcola_statistiche():
+    with ricalcolo_lock:
+        if ricalcolo["in_corso"]:
+            ricalcolo["da_rifare"] = True
+            return None
+        ricalcolo["in_corso"] = True
 
-    # reset statistiche ore
-    query_db("DELETE FROM statistiche_ore", commit=True)
+    try:
+        while True:
+            with ricalcolo_lock:
+                ricalcolo["da_rifare"] = False
+            esegui_db(_ricalcola_statistiche)
+            with ricalcolo_lock:
+                if not ricalcolo["da_rifare"]:
+                    ricalcolo["in_corso"] = False
+                    return None
+    except Exception:
+        with ricalcolo_lock:
+            ricalcolo["in_corso"] = False
+        raise
+
+# poche query set-based in un'unica transazione: il thread DB resta occupato pochi ms
+def _ricalcola_statistiche():
+    with get_db() as conn:
+        cur = conn.cursor()
 
-    # categorie dashboard fisse
-    categorie = ["Bar", "Cucina", "Griglia", "Gnoccheria"]
+        # reset statistiche
+        cur.execute("DELETE FROM statistiche_totali")
+        cur.execute("DELETE FROM statistiche_categorie")
+        cur.execute("DELETE FROM statistiche_ore")
 
-    # inserisce le categorie
-    for cat in categorie:
-        query_db("""
+        # categorie dashboard fisse
+        categorie = ["Bar", "Cucina", "Griglia", "Gnoccheria"]
+        cur.executemany("""
             INSERT INTO statistiche_categorie (categoria_dashboard, totale)
-            VALUES (?, 0)
-        """, (cat,), commit=True)
-
-    # inizializza ore da 0 a 23
-    for h in range(24):
-        query_db("""
-            INSERT INTO statistiche_ore (ora, totale)
-            VALUES (?, 0)
-        """, (h,), commit=True)
-
-    # inizializza totali incasso
-    totale_incasso = 0
-    totale_contanti = 0
-    totale_carta = 0
-
-    # ciclo su tutti gli ordini
-    for ordine in ordini:
-        ordine_id = ordine["id"]
-        metodo = ordine["metodo_pagamento"]
-
-        # calcola incasso dell'ordine
-        incasso_ordine = query_db("""
-            SELECT SUM(p.prezzo * op.quantita) AS totale
+            SELECT ?, COALESCE(SUM(op.quantita), 0)
             FROM ordini_prodotti op
+            JOIN ordini o ON o.id = op.ordine_id
             JOIN prodotti p ON p.id = op.prodotto_id
-            WHERE op.ordine_id = ?
-        """, (ordine_id,), one=True)["totale"] or 0
+            WHERE p.categoria_dashboard = ?
+        """, [(cat, cat) for cat in categorie])
 
-        # somma incasso totale
-        totale_incasso += incasso_ordine
+        # ordini per ora, da 0 a 23 anche senza ordini
+        cur.execute("""
+            WITH RECURSIVE ore(ora) AS (
+                SELECT 0 UNION ALL SELECT ora + 1 FROM ore WHERE ora < 23
+            ),
+            conteggi AS (
+                SELECT CAST(strftime('%H', data_ordine) AS INT) AS ora, COUNT(*) AS totale
+                FROM ordini
+                GROUP BY 1
+            )
+            INSERT INTO statistiche_ore (ora, totale)
+            SELECT ore.ora, COALESCE(conteggi.totale, 0)
+            FROM ore
+            LEFT JOIN conteggi ON conteggi.ora = ore.ora
+        """)
 
-        # aggiorna incassi contanti/carta
-        if metodo == "Contanti":
-            totale_contanti += incasso_ordine
-        else:
-            totale_carta += incasso_ordine
-
-        # calcola ora dell'ordine
-        ora = query_db("""
-            SELECT CAST(strftime('%H', data_ordine) AS INT) AS h
-            FROM ordini WHERE id = ?
-        """, (ordine_id,), one=True)["h"]
-
-        # aggiorna statistiche per ora
-        query_db("""
-            UPDATE statistiche_ore
-            SET totale = totale + 1
-            WHERE ora = ?
-        """, (ora,), commit=True)
-
-        # calcola categorie dashboard coinvolte
-        righe_cat = query_db("""
-            SELECT p.categoria_dashboard, SUM(op.quantita) AS qta
+        # totali ordini e incassi (tutto cio' che non e' contanti conta come carta)
+        cur.execute("""
+            INSERT INTO statistiche_totali
+            (id, ordini_totali, ordini_completati, totale_incasso, totale_contanti, totale_carta)
+            SELECT
+                1,
+                (SELECT COUNT(*) FROM ordini),
+                (SELECT COUNT(*) FROM ordini WHERE completato = 1),
+                COALESCE(SUM(op.prezzo * op.quantita), 0),
+                COALESCE(SUM(CASE WHEN o.metodo_pagamento = 'Contanti' THEN op.prezzo * op.quantita END), 0),
+                COALESCE(SUM(CASE WHEN o.metodo_pagamento != 'Contanti' THEN op.prezzo * op.quantita END), 0)
             FROM ordini_prodotti op
-            JOIN prodotti p ON p.id = op.prodotto_id
-            WHERE op.ordine_id = ?
-            GROUP BY p.categoria_dashboard
-        """, (ordine_id,))
-
-        # aggiorna statistiche categorie
-        for r in righe_cat:
-            query_db("""
-                UPDATE statistiche_categorie
-                SET totale = totale + ?
-                WHERE categoria_dashboard = ?
-            """, (r["qta"], r["categoria_dashboard"]), commit=True)
-
-    # inserisce statistiche totali
-    query_db("""
-        INSERT INTO statistiche_totali
-        (id, ordini_totali, ordini_completati, totale_incasso, totale_contanti, totale_carta)
-        VALUES (1, ?, ?, ?, ?, ?)
-    """, (
-        ordini_totali,
-        ordini_completati,
-        totale_incasso,
-        totale_contanti,
-        totale_carta
-    ), commit=True)
+            JOIN ordini o ON o.id = op.ordine_id
+        """)
+        conn.commit()
 
     return None
 
@@ -665,13 +1168,18 @@ def genera_statistiche():
     ricalcola_statistiche()
     return redirect('/amministrazione/')
 
+def azzera_dati():
+    with get_db() as conn:
+        conn.execute("DELETE FROM ordini_prodotti")
+        conn.execute("DELETE FROM ordini")
+        conn.execute("UPDATE prodotti SET disponibile = 1, quantita = 100, venduti = 0")
+        conn.commit()
+
 @app.route('/debug/reset_dati/')
 @login_required
 @require_permission("AMMINISTRAZIONE")
 def debug_reset_dati():
-    query_db("DELETE FROM ordini_prodotti", commit=True)
-    query_db("DELETE FROM ordini", commit=True)
-    query_db("UPDATE prodotti SET disponibile = 1, quantita = 100, venduti = 0", commit=True)
+    esegui_db(azzera_dati)
     ricalcola_statistiche()
     return redirect('/amministrazione/')
 
@@ -717,5 +1225,6 @@ if __name__ == '__main__':
         s.close()
     port = int(os.environ.get("PORT", 5001))
     print(f'Avvio server — apri: http://{ip}:{port}/')
+    create_app()
     socketio.run(app, host='0.0.0.0', port=port, debug=False)
     
@@ -0,0 +1,73 @@
+"""Benchmark della ricerca ordini su un database con molti ordini.
+
+Crea un database temporaneo con il menu di esempio e N ordini casuali,
+poi misura cerca_ordini() con i filtri usati in cassa.
+
+    python bench_ricerca.py [ordini]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+
+COGNOMI = ["Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo",
+           "Ricci", "Marino", "Greco", "Bruno", "Gallo", "Conti", "De Luca", "Mancini"]
+NOMI = ["Marco", "Giulia", "Luca", "Sara", "Andrea", "Chiara", "Paolo", "Anna"]
+STATI = ["In Attesa", "In Preparazione", "Pronto", "Completato"]
+
+
+def popola(byte_bite, n_ordini):
+    with open(os.path.join(CARTELLA, "query_prodotti")) as f, byte_bite.get_db() as conn:
+        conn.executescript(f.read())
+        prodotti = [r[0] for r in conn.execute("SELECT id FROM prodotti")]
+
+        random.seed(42)
+        for i in range(n_ordini):
+            cur = conn.execute("""
+                INSERT INTO ordini (asporto, nome_cliente, numero_tavolo, numero_persone, metodo_pagamento, data_ordine)
+                VALUES (0, ?, ?, 2, 'Carta', datetime('2025-06-01', ? || ' seconds'))
+            """, (f"{random.choice(NOMI)} {random.choice(COGNOMI)}", random.randint(1, 60), i * 10))
+            for prodotto_id in random.sample(prodotti, 3):
+                conn.execute("""
+                    INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita, stato, prezzo)
+                    VALUES (?, ?, 1, ?, 5)
+                """, (cur.lastrowid, prodotto_id, random.choice(STATI)))
+        conn.commit()
+
+
+def misura(nome, fn, ripetizioni=200):
+    fn()
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        fn()
+        tempi.append((time.perf_counter() - t0) * 1000)
+    print(f"  {nome:<32} mediana {statistics.median(tempi):6.3f} ms   p95 {sorted(tempi)[int(len(tempi) * 0.95)]:6.3f} ms")
+
+
+def main():
+    n_ordini = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "db.sqlite3")
+        os.environ.setdefault("ASYNC_MODE", "threading")
+        sys.path.insert(0, CARTELLA)
+        import app as byte_bite
+
+        byte_bite.assicura_schema()
+        popola(byte_bite, n_ordini)
+
+        print(f"ordini: {n_ordini}")
+        misura("nome (prefisso)", lambda: byte_bite.cerca_ordini("ross", limite=10))
+        misura("nome + tavolo", lambda: byte_bite.cerca_ordini("rossi", tavolo=12, limite=10))
+        misura("tavolo", lambda: byte_bite.cerca_ordini(tavolo=12, limite=10))
+        misura("stato + intervallo", lambda: byte_bite.cerca_ordini(
+            stato="Pronto", da="2025-06-02 00:00:00", a="2025-06-02 23:59:59", limite=10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark di avvio: tempo dal lancio del processo al primo ordine salvato.
+
+Ogni giro usa un database nuovo in una cartella temporanea, con il menu di
+esempio gia' caricato (come il disco persistente su Render), e gira in un
+processo separato cosi' anche l'import di app.py viene misurato.
+Di default usa la configurazione del deploy: gevent con DB_EXECUTOR=1
+(sovrascrivibili con ASYNC_MODE / DB_EXECUTOR).
+
+    python bench_startup.py [giri]
+"""
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+
+
+def giro():
+    t0 = time.perf_counter()
+    if os.environ.get("ASYNC_MODE") == "gevent":
+        # come il worker gevent di gunicorn
+        from gevent import monkey
+        monkey.patch_all()
+    sys.path.insert(0, CARTELLA)
+    import app as byte_bite
+
+    tempi = {"import": time.perf_counter() - t0}
+
+    byte_bite.create_app()
+    tempi["schema"] = time.perf_counter() - t0
+
+    client = byte_bite.app.test_client()
+    while client.get("/ready/").status_code != 200:
+        byte_bite.socketio.sleep(0.005)
+    tempi["pronto"] = time.perf_counter() - t0
+
+    ordine = {
+        "nome_cliente": "Bench",
+        "numero_tavolo": "1",
+        "numero_persone": "2",
+        "metodo_pagamento": "Contanti",
+        "prodotti": json.dumps([{"id": 1, "quantita": 2}, {"id": 5, "quantita": 1}]),
+    }
+    risposta = client.post("/aggiungi_ordine/", data=ordine)
+    assert risposta.status_code == 303, risposta.status_code
+    tempi["primo_ordine"] = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    client.post("/aggiungi_ordine/", data=ordine)
+    tempi["secondo_ordine_ms"] = (time.perf_counter() - t1) * 1000
+
+    print(json.dumps(tempi))
+
+
+def prepara_db(path):
+    conn = sqlite3.connect(path)
+    for script in ("db.sql", "query_prodotti"):
+        with open(os.path.join(CARTELLA, script)) as f:
+            conn.executescript(f.read())
+    conn.close()
+
+
+def main():
+    giri = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    risultati = []
+
+    for _ in range(giri):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ)
+            env["DATABASE_PATH"] = os.path.join(tmp, "db.sqlite3")
+            env.setdefault("ASYNC_MODE", "gevent")
+            env.setdefault("DB_EXECUTOR", "1")
+            prepara_db(env["DATABASE_PATH"])
+            out = subprocess.run(
+                [sys.executable, __file__, "--giro"],
+                env=env, cwd=CARTELLA, capture_output=True, text=True, check=True
+            ).stdout
+            risultati.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"giri: {giri} (mediana), ASYNC_MODE={os.environ.get('ASYNC_MODE', 'gevent')}, "
+          f"DB_EXECUTOR={os.environ.get('DB_EXECUTOR', '1')}")
+    for chiave in risultati[0]:
+        valore = statistics.median(r[chiave] for r in risultati)
+        if chiave.endswith("_ms"):
+            print(f"  {chiave:<20} {valore:8.2f} ms")
+        else:
+            print(f"  {chiave:<20} {valore * 1000:8.2f} ms dall'avvio")
+
+
+if __name__ == "__main__":
+    if "--giro" in sys.argv:
+        giro()
+    else:
+        main()
@@ -25,9 +25,60 @@ CREATE TABLE IF NOT EXISTS ordini_prodotti (
     prodotto_id INTEGER REFERENCES prodotti(id),
     quantita INTEGER NOT NULL CHECK (quantita > 0),
     stato TEXT NOT NULL DEFAULT 'In Attesa' CHECK (stato IN ('In Attesa', 'In Preparazione', 'Pronto', 'Completato')),
+    prezzo REAL NOT NULL DEFAULT 0, -- prezzo unitario al momento della vendita
     PRIMARY KEY (ordine_id, prodotto_id)
 );
 
+/* versioni del menu importate dall'amministrazione */
+CREATE TABLE IF NOT EXISTS cataloghi (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT NOT NULL,
+    data_creazione DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    attivo BOOLEAN NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS cataloghi_prodotti (
+    catalogo_id INTEGER NOT NULL REFERENCES cataloghi(id) ON DELETE CASCADE,
+    posizione INTEGER NOT NULL,
+    nome TEXT NOT NULL,
+    prezzo REAL NOT NULL CHECK (prezzo >= 0),
+    categoria_menu TEXT NOT NULL,
+    categoria_dashboard TEXT NOT NULL CHECK (categoria_dashboard IN ('Bar', 'Cucina', 'Gnoccheria', 'Griglia', 'Coperto')),
+    disponibile BOOLEAN NOT NULL DEFAULT 1,
+    quantita INTEGER NOT NULL CHECK (quantita >= 0),
+    PRIMARY KEY (catalogo_id, nome)
+);
+
+/* indici per dashboard, cassa e statistiche */
+CREATE INDEX IF NOT EXISTS idx_prodotti_categoria_dashboard ON prodotti(categoria_dashboard);
+CREATE INDEX IF NOT EXISTS idx_prodotti_categoria_menu ON prodotti(categoria_menu);
+CREATE INDEX IF NOT EXISTS idx_ordini_prodotti_prodotto ON ordini_prodotti(prodotto_id);
+CREATE INDEX IF NOT EXISTS idx_ordini_data ON ordini(data_ordine);
+CREATE INDEX IF NOT EXISTS idx_ordini_tavolo ON ordini(numero_tavolo, data_ordine);
+CREATE INDEX IF NOT EXISTS idx_ordini_prodotti_stato ON ordini_prodotti(stato, ordine_id);
+
+/* ricerca ordini per nome cliente (indice full-text tenuto allineato dai trigger) */
+CREATE VIRTUAL TABLE IF NOT EXISTS ordini_fts USING fts5(
+    nome_cliente,
+    content='ordini',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS ordini_fts_insert AFTER INSERT ON ordini BEGIN
+    INSERT INTO ordini_fts (rowid, nome_cliente) VALUES (new.id, new.nome_cliente);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ordini_fts_delete AFTER DELETE ON ordini BEGIN
+    INSERT INTO ordini_fts (ordini_fts, rowid, nome_cliente) VALUES ('delete', old.id, old.nome_cliente);
+END;
+
+CREATE TRIGGER IF NOT EXISTS ordini_fts_update AFTER UPDATE OF nome_cliente ON ordini BEGIN
+    INSERT INTO ordini_fts (ordini_fts, rowid, nome_cliente) VALUES ('delete', old.id, old.nome_cliente);
+    INSERT INTO ordini_fts (rowid, nome_cliente) VALUES (new.id, new.nome_cliente);
+END;
+
 /* tabelle per statistiche */
 CREATE TABLE IF NOT EXISTS statistiche_totali (
     id INT PRIMARY KEY,
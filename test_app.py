@@ -0,0 +1,313 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+os.environ.setdefault("ASYNC_MODE", "threading")
+
+import app as byte_bite
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.sqlite3")
+    monkeypatch.setenv("DATABASE_PATH", path)
+    # i task in background girano subito, nello stesso thread del test
+    monkeypatch.setattr(byte_bite.socketio, "start_background_task", lambda f, *a, **k: f(*a, **k))
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    byte_bite.assicura_schema()
+    with byte_bite.get_db() as conn:
+        conn.executescript("""
+            INSERT INTO prodotti (nome, prezzo, categoria_menu, categoria_dashboard, disponibile, quantita, venduti)
+            VALUES
+            ('Spritz', 4, 'Aperitivi', 'Bar', 1, 100, 0),
+            ('Tortelli', 9, 'Primi', 'Cucina', 1, 100, 0);
+            INSERT INTO utenti (username, password_hash, is_admin) VALUES ('admin', 'x', 1);
+        """)
+
+    client = byte_bite.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    return client
+
+
+def nuovo_ordine(client, prodotti, nome="Rossi", tavolo="12"):
+    return client.post("/aggiungi_ordine/", data={
+        "nome_cliente": nome,
+        "numero_tavolo": tavolo,
+        "numero_persone": "2",
+        "metodo_pagamento": "Contanti",
+        "prodotti": byte_bite.json.dumps(prodotti),
+    })
+
+
+@pytest.fixture
+def esecutore(monkeypatch):
+    esecutore = byte_bite.DBExecutor(1, 1)
+    monkeypatch.setattr(byte_bite, "DB_EXECUTOR", True)
+    monkeypatch.setattr(byte_bite, "db_executor", esecutore)
+    yield esecutore
+    if esecutore._pool is not None:
+        esecutore._pool.shutdown(wait=True)
+
+
+def test_coda_piena_risponde_503(client, esecutore):
+    esecutore.in_attesa = 1
+    r = client.get("/api/ordine/1")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+    esecutore.in_attesa = 0
+    assert client.get("/api/ordine/1").status_code == 404
+
+
+def test_task_in_background_mai_rifiutati(client, esecutore):
+    esecutore.in_attesa = 1
+    assert byte_bite.query_db("SELECT 42 AS n", one=True)["n"] == 42
+    byte_bite.ricalcola_statistiche()
+
+
+def test_richiesta_ammessa_non_rifiutata_a_meta(client, esecutore):
+    with byte_bite.app.test_request_context():
+        assert byte_bite.esegui_db(lambda: 1) == 1
+        esecutore.in_attesa = 1
+        assert byte_bite.esegui_db(lambda: 2) == 2
+    esecutore.in_attesa = 0
+
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}])
+    r = client.post("/cambia_stato/", json={"ordine_id": 1, "categoria": "Bar"})
+    assert r.get_json()["nuovo_stato"] == "In Preparazione"
+    assert esecutore.in_attesa == 0
+
+
+def test_chiamate_annidate_senza_deadlock(db_path, esecutore):
+    risultato = []
+
+    def esterna():
+        # gia' dentro il thread dell'esecutore: la query interna non torna in coda
+        assert threading.current_thread().name.startswith("db")
+        return byte_bite.query_db("SELECT 42 AS n", one=True)["n"]
+
+    t = threading.Thread(target=lambda: risultato.append(byte_bite.esegui_db(esterna)), daemon=True)
+    t.start()
+    t.join(timeout=5)
+    assert risultato == [42]
+
+
+def test_ricalcolo_statistiche_accorpato(monkeypatch):
+    giri = []
+
+    def ricalcolo_finto():
+        giri.append(1)
+        if len(giri) == 1:
+            # tre richieste durante il ricalcolo: ne resta una sola in attesa
+            for _ in range(3):
+                byte_bite.ricalcola_statistiche()
+            assert byte_bite.ricalcolo == {"in_corso": True, "da_rifare": True}
+
+    monkeypatch.setattr(byte_bite, "_ricalcola_statistiche", ricalcolo_finto)
+    byte_bite.ricalcola_statistiche()
+
+    assert len(giri) == 2
+    assert byte_bite.ricalcolo == {"in_corso": False, "da_rifare": False}
+
+
+def test_migrazione_riempie_prezzo_righe(db_path):
+    with open(os.path.join(CARTELLA, "db.sql")) as f:
+        schema = f.read()
+    # schema precedente: ordini_prodotti senza la colonna prezzo
+    vecchio = "\n".join(l for l in schema.splitlines() if not l.strip().startswith("prezzo REAL NOT NULL DEFAULT 0"))
+    conn = sqlite3.connect(db_path)
+    conn.executescript(vecchio)
+    conn.executescript("""
+        INSERT INTO prodotti (id, nome, prezzo, categoria_menu, categoria_dashboard, quantita, venduti)
+        VALUES (1, 'Spritz', 4.5, 'Aperitivi', 'Bar', 10, 2);
+        INSERT INTO ordini (id, asporto, nome_cliente, metodo_pagamento) VALUES (1, 1, 'Rossi', 'Carta');
+        INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita) VALUES (1, 1, 2);
+        -- riga di un prodotto cancellato
+        INSERT INTO ordini_prodotti (ordine_id, prodotto_id, quantita) VALUES (1, 77, 1);
+    """)
+    conn.close()
+
+    byte_bite.assicura_schema()
+    byte_bite.assicura_schema()  # idempotente
+
+    righe = byte_bite.query_db("SELECT prodotto_id, prezzo FROM ordini_prodotti ORDER BY prodotto_id")
+    assert [tuple(r) for r in righe] == [(1, 4.5), (77, 0)]
+
+
+def test_attiva_catalogo_mantiene_incasso_storico(client):
+    assert nuovo_ordine(client, [{"id": 1, "quantita": 2}]).status_code == 303
+    assert client.get("/api/statistiche/").get_json()["totali"]["totale_incasso"] == 8
+
+    menu = {"nome": "Sera", "prodotti": [
+        {"nome": "Spritz", "prezzo": 6, "categoria_menu": "Aperitivi", "categoria_dashboard": "Bar", "quantita": 50},
+        {"nome": "Gnocco", "prezzo": 3, "categoria_menu": "Gnocco", "categoria_dashboard": "Gnoccheria", "quantita": 20},
+    ]}
+    r = client.post("/api/menu/importa/", json=menu)
+    assert r.status_code == 201
+    catalogo_id = r.get_json()["catalogo_id"]
+    assert client.post(f"/api/menu/cataloghi/{catalogo_id}/attiva/").status_code == 200
+
+    prodotti = {r["nome"]: r for r in byte_bite.query_db("SELECT * FROM prodotti")}
+    assert prodotti["Spritz"]["prezzo"] == 6
+    assert prodotti["Tortelli"]["disponibile"] == 0
+    assert prodotti["Gnocco"]["quantita"] == 20
+
+    # il vecchio ordine resta al prezzo di vendita, il nuovo usa il prezzo attuale
+    assert client.get("/api/statistiche/").get_json()["totali"]["totale_incasso"] == 8
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}])
+    assert client.get("/api/statistiche/").get_json()["totali"]["totale_incasso"] == 14
+    assert byte_bite.query_db("SELECT totale_incasso FROM statistiche_totali", one=True)[0] == 14
+
+
+def test_ordine_con_prodotto_inesistente_rifiutato(client):
+    r = nuovo_ordine(client, [{"id": 1, "quantita": 1}, {"id": 9999, "quantita": 1}])
+    assert r.status_code == 400
+    assert byte_bite.query_db("SELECT COUNT(*) AS c FROM ordini", one=True)["c"] == 0
+    assert byte_bite.query_db("SELECT quantita FROM prodotti WHERE id = 1", one=True)["quantita"] == 100
+
+
+def test_importa_menu_lista_json(client):
+    menu = [{"nome": "Spritz", "prezzo": 5, "categoria_menu": "Aperitivi", "categoria_dashboard": "Bar", "quantita": 5}]
+    r = client.post("/api/menu/importa/?attiva=1", json=menu)
+    assert r.status_code == 201
+    assert r.get_json()["attivo"] is True
+
+    assert client.post("/api/menu/importa/", json="menu").status_code == 400
+
+
+@pytest.mark.parametrize("campo, valore", [
+    ("prezzo", "nan"),
+    ("prezzo", "inf"),
+    ("quantita", 1.7),
+    ("quantita", "1.7"),
+    ("disponibile", "forse"),
+])
+def test_importa_menu_valori_non_validi(client, campo, valore):
+    prodotto = {"nome": "Spritz", "prezzo": 5, "categoria_menu": "Aperitivi", "categoria_dashboard": "Bar", "quantita": 5}
+    prodotto[campo] = valore
+    assert client.post("/api/menu/importa/", json={"prodotti": [prodotto]}).status_code == 400
+
+
+@pytest.mark.parametrize("modifica", [
+    {"categoria_menu": ["Aperitivi"], "disponibile": 0},
+    {"ids": [1], "disponibile": ""},
+    {"ids": [1], "disponibile": "maybe"},
+    {"ids": [1], "quantita": 2.5},
+])
+def test_aggiorna_prodotti_valori_non_validi(client, modifica):
+    assert client.post("/api/menu/prodotti/", json=modifica).status_code == 400
+    assert byte_bite.query_db("SELECT disponibile, quantita FROM prodotti WHERE id = 1", one=True)[:] == (1, 100)
+
+
+def test_aggiorna_prodotti_ids_non_lista(client):
+    r = client.post("/api/menu/prodotti/", json={"ids": "12", "disponibile": 0})
+    assert r.status_code == 400
+
+    r = client.post("/api/menu/prodotti/", json={"categoria_menu": "Primi", "disponibile": "false"})
+    assert r.get_json()["aggiornati"] == 1
+    assert byte_bite.query_db("SELECT disponibile FROM prodotti WHERE id = 2", one=True)[0] == 0
+
+    r = client.post("/api/menu/prodotti/", json={"ids": [1, 2], "delta_quantita": -150})
+    assert r.get_json()["aggiornati"] == 2
+    assert byte_bite.query_db("SELECT MIN(quantita) AS q FROM prodotti", one=True)["q"] == 0
+
+
+@pytest.fixture
+def stato_avvio(monkeypatch):
+    monkeypatch.setattr(byte_bite, "stato_avvio", {"avviato": False, "pronto": False, "secondi": None, "errore": None})
+    return byte_bite.stato_avvio
+
+
+def test_ready_solo_dopo_riscaldamento(client, stato_avvio):
+    assert client.get("/ready/").status_code == 503
+
+    byte_bite.riscalda_app()
+
+    r = client.get("/ready/")
+    assert r.status_code == 200
+    assert r.get_json()["pronto"] is True
+    assert byte_bite.query_db("SELECT COUNT(*) AS c FROM statistiche_ore", one=True)["c"] == 24
+
+
+def test_ready_resta_503_se_riscaldamento_fallisce(client, stato_avvio, monkeypatch):
+    def guasto():
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(byte_bite, "ricalcola_statistiche", guasto)
+
+    byte_bite.riscalda_app()
+
+    r = client.get("/ready/")
+    assert r.status_code == 503
+    assert "disk I/O error" in r.get_json()["errore"]
+
+
+def cerca(client, **filtri):
+    return client.get("/api/ordini/cerca/", query_string=filtri)
+
+
+def test_indice_fts_segue_insert_update_delete(client):
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}], nome="Mario Rossì")
+    nuovo_ordine(client, [{"id": 2, "quantita": 1}], nome="Anna Bianchi", tavolo="5")
+
+    ordini = cerca(client, q="ross").get_json()["ordini"]
+    assert [o["nome_cliente"] for o in ordini] == ["Mario Rossì"]
+    assert ordini[0]["stati"] == {"Bar": "In Attesa"}
+    assert ordini[0]["items"][0]["prezzo"] == 4
+
+    byte_bite.query_db("UPDATE ordini SET nome_cliente = 'Mario Verdi' WHERE id = 1", commit=True)
+    assert cerca(client, q="ross").get_json()["ordini"] == []
+    assert len(cerca(client, q="verd").get_json()["ordini"]) == 1
+
+    byte_bite.query_db("DELETE FROM ordini WHERE id = 1", commit=True)
+    assert cerca(client, q="verd").get_json()["ordini"] == []
+    assert len(cerca(client, q="bian", tavolo=5).get_json()["ordini"]) == 1
+
+
+def test_ricerca_testo_senza_parole_rifiutata(client):
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}])
+    assert cerca(client, q="!!").status_code == 400
+    assert len(cerca(client, q="  ").get_json()["ordini"]) == 1
+
+
+def test_intervallo_orario_in_ora_locale(client):
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}])
+    # 18:30 UTC = 20:30 a Roma (ora legale)
+    byte_bite.query_db("UPDATE ordini SET data_ordine = '2025-06-02 18:30:00'", commit=True)
+
+    assert len(cerca(client, da="2025-06-02T20:00", a="2025-06-02T21:00").get_json()["ordini"]) == 1
+    assert cerca(client, da="2025-06-02T18:00", a="2025-06-02T19:00").get_json()["ordini"] == []
+    assert len(cerca(client, da="2025-06-02T20:00:00+02:00", a="2025-06-02T18:45:00Z").get_json()["ordini"]) == 1
+    assert len(cerca(client, a="2025-06-02").get_json()["ordini"]) == 1
+
+
+def test_indice_fts_ricostruito_se_vuoto(client):
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}], nome="Rossi")
+    # come create_db.py su un database gia' usato: indice creato vuoto
+    byte_bite.query_db("INSERT INTO ordini_fts (ordini_fts) VALUES ('delete-all')", commit=True)
+    assert byte_bite.cerca_ordini("ross") == []
+
+    byte_bite.assicura_schema()
+    assert [o["nome_cliente"] for o in byte_bite.cerca_ordini("ross")] == ["Rossi"]
+
+
+def test_ricerca_con_prodotto_cancellato(client):
+    nuovo_ordine(client, [{"id": 1, "quantita": 1}, {"id": 2, "quantita": 1}])
+    byte_bite.query_db("DELETE FROM prodotti WHERE id = 2", commit=True)
+
+    r = cerca(client, q="rossi")
+    assert r.status_code == 200
+    assert r.get_json()["ordini"][0]["stati"] == {"Bar": "In Attesa"}
+
+
+def test_intervallo_orario_fuori_limiti(client):
+    assert cerca(client, da="0001-01-01").status_code == 400
+    assert cerca(client, a="9999-12-31T23:59:59-05:00").status_code == 400